@@ -0,0 +1,21 @@
+import logging
+import os
+from scraper.compaction import RollupCompactor
+
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+
+def main():
+    setup_logging()
+    compactor = RollupCompactor(
+        bucket_name="fitnesspark-attendance-data",
+        raw_retention_days=int(os.environ.get("RAW_RETENTION_DAYS", 35)),
+        hourly_retention_days=int(os.environ.get("HOURLY_RETENTION_DAYS", 365)),
+    )
+    compactor.compact()
+
+if __name__ == "__main__":
+    main()
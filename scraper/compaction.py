@@ -0,0 +1,175 @@
+import logging
+import json
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from google.cloud import storage
+from google.api_core.exceptions import PreconditionFailed
+
+TZ = ZoneInfo("Europe/Zurich")
+
+
+def _bucket_start(timestamp: str, resolution: str) -> datetime:
+    """Floor an ISO timestamp to the start of its local hour or day."""
+    ts = datetime.fromisoformat(timestamp)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=TZ)
+    ts = ts.astimezone(TZ)
+    if resolution == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return datetime(ts.year, ts.month, ts.day, tzinfo=TZ)
+
+
+def rollup(records: list[dict], resolution: str) -> dict[str, dict]:
+    """
+    Aggregate raw records ({"count": n}) or finer rollups
+    ({"min", "mean", "max", "count"}) into min/mean/max/count per bucket.
+    Returns {bucket ISO timestamp: summary}.
+    """
+    buckets = {}
+    for record in records:
+        if "mean" in record:
+            low, high = record["min"], record["max"]
+            total, n = record["mean"] * record["count"], record["count"]
+        elif isinstance(record.get("count"), (int, float)):
+            low = high = total = record["count"]
+            n = 1
+        else:
+            # Failed scrapes carry no count
+            continue
+
+        key = _bucket_start(record["timestamp"], resolution).isoformat()
+        if key not in buckets:
+            buckets[key] = {"min": low, "max": high, "total": 0, "count": 0}
+        bucket = buckets[key]
+        bucket["min"] = min(bucket["min"], low)
+        bucket["max"] = max(bucket["max"], high)
+        bucket["total"] += total
+        bucket["count"] += n
+
+    return {
+        key: {
+            "timestamp": key,
+            "min": b["min"],
+            "mean": round(b["total"] / b["count"], 2),
+            "max": b["max"],
+            "count": b["count"],
+        }
+        for key, b in buckets.items()
+    }
+
+
+class RollupCompactor:
+    """
+    Compacts the attendance log into retention tiers in Cloud Storage:
+
+    * raw 10-minute samples for the last `raw_retention_days`
+    * hourly min/mean/max/count for the last `hourly_retention_days`
+    * daily min/mean/max/count for everything older
+
+    Rollups are keyed by bucket start and replace existing rows with the
+    same key, so re-running after a partial failure is idempotent. The raw
+    file is rewritten with a generation precondition so records appended by
+    the scraper during compaction are never lost.
+    """
+
+    def __init__(
+        self,
+        bucket_name: str,
+        filename: str = "attendance/attendance_data.jsonl",
+        hourly_filename: str = "attendance/attendance_hourly.jsonl",
+        daily_filename: str = "attendance/attendance_daily.jsonl",
+        raw_retention_days: int = 35,
+        hourly_retention_days: int = 365,
+    ):
+        if raw_retention_days < 28:
+            # The dashboard's 4-week views are computed from raw samples
+            raise ValueError("raw_retention_days must be at least 28")
+        if hourly_retention_days < raw_retention_days:
+            raise ValueError("hourly_retention_days must be >= raw_retention_days")
+
+        self.bucket_name = bucket_name
+        self.filename = filename
+        self.hourly_filename = hourly_filename
+        self.daily_filename = daily_filename
+        self.raw_retention_days = raw_retention_days
+        self.hourly_retention_days = hourly_retention_days
+        self.client = storage.Client()
+        self.bucket = self.client.bucket(bucket_name)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def _read(self, filename: str) -> tuple[list[dict], int]:
+        """Return (records, generation); generation is 0 if the blob is missing."""
+        blob = self.bucket.get_blob(filename)
+        if blob is None:
+            return [], 0
+        text = blob.download_as_text()
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+        return records, blob.generation
+
+    def _write(self, filename: str, records: list[dict], generation: int) -> None:
+        data = "".join(json.dumps(r) + "\n" for r in records)
+        self.bucket.blob(filename).upload_from_string(
+            data,
+            content_type="application/json",
+            if_generation_match=generation,
+        )
+
+    @staticmethod
+    def _split(records: list[dict], cutoff: datetime) -> tuple[list, list]:
+        old, recent = [], []
+        for record in records:
+            ts = datetime.fromisoformat(record["timestamp"])
+            if ts.tzinfo is None:
+                ts = ts.replace(tzinfo=TZ)
+            (old if ts < cutoff else recent).append(record)
+        return old, recent
+
+    @staticmethod
+    def _merge(existing: list[dict], rollups: dict[str, dict]) -> list[dict]:
+        merged = {r["timestamp"]: r for r in existing}
+        merged.update(rollups)
+        return sorted(merged.values(), key=lambda r: datetime.fromisoformat(r["timestamp"]))
+
+    def compact(self, now: datetime | None = None) -> dict[str, int]:
+        """Run one compaction pass and return the row count per tier."""
+        now = (now or datetime.now(TZ)).astimezone(TZ)
+        today = datetime(now.year, now.month, now.day, tzinfo=TZ)
+        raw_cutoff = today - timedelta(days=self.raw_retention_days)
+        hourly_cutoff = today - timedelta(days=self.hourly_retention_days)
+
+        raw, raw_generation = self._read(self.filename)
+        hourly, hourly_generation = self._read(self.hourly_filename)
+        daily, daily_generation = self._read(self.daily_filename)
+
+        old_raw, recent_raw = self._split(raw, raw_cutoff)
+        hourly = self._merge(hourly, rollup(old_raw, "hour"))
+        old_hourly, recent_hourly = self._split(hourly, hourly_cutoff)
+        daily = self._merge(daily, rollup(old_hourly, "day"))
+
+        # Write coarse tiers first: a crash afterwards only leaves data that
+        # the next run rolls up again to the same rows.
+        self._write(self.daily_filename, daily, daily_generation)
+        self._write(self.hourly_filename, recent_hourly, hourly_generation)
+        raw_compacted = False
+        if old_raw:
+            try:
+                self._write(self.filename, recent_raw, raw_generation)
+                raw_compacted = True
+            except PreconditionFailed:
+                self.logger.warning(
+                    "Raw log changed during compaction; will retry next run."
+                )
+
+        counts = {
+            "raw": len(recent_raw) if raw_compacted else len(raw),
+            "hourly": len(recent_hourly),
+            "daily": len(daily),
+        }
+        self.logger.info(
+            "Compacted gs://%s: %d raw, %d hourly, %d daily rows",
+            self.bucket_name,
+            counts["raw"],
+            counts["hourly"],
+            counts["daily"],
+        )
+        return counts
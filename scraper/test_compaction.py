@@ -0,0 +1,234 @@
+# test_compaction.py
+
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+from scraper.compaction import TZ, RollupCompactor, rollup
+
+RAW = "attendance/attendance_data.jsonl"
+HOURLY = "attendance/attendance_hourly.jsonl"
+DAILY = "attendance/attendance_daily.jsonl"
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def generation(self):
+        return self.bucket.files[self.name][1]
+
+    def download_as_text(self):
+        return self.bucket.files[self.name][0]
+
+    def upload_from_string(self, data, content_type, if_generation_match):
+        current = self.bucket.files.get(self.name, ("", 0))[1]
+        if self.name in self.bucket.appended_during_upload:
+            # Simulate the scraper appending between our read and write
+            current += 1
+            self.bucket.files[self.name] = (self.bucket.files[self.name][0], current)
+        if current != if_generation_match:
+            raise PreconditionFailed("generation mismatch")
+        self.bucket.files[self.name] = (data, current + 1)
+
+
+class FakeBucket:
+    """In-memory stand-in for a Cloud Storage bucket with generations."""
+
+    def __init__(self):
+        self.files = {}
+        self.appended_during_upload = set()
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.files else None
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def put(self, name, records):
+        self.files[name] = ("".join(json.dumps(r) + "\n" for r in records), 1)
+
+    def records(self, name):
+        return [json.loads(line) for line in self.files[name][0].splitlines()]
+
+
+@pytest.fixture
+def bucket():
+    return FakeBucket()
+
+
+@pytest.fixture
+def compactor(bucket):
+    with patch("scraper.compaction.storage.Client") as mock_client:
+        mock_client.return_value.bucket.return_value = bucket
+        yield RollupCompactor("test-bucket")
+
+
+NOW = datetime(2025, 12, 1, 12, 0, tzinfo=TZ)
+
+
+def raw_records(start, end, count=lambda ts: ts.hour):
+    """Samples every 10 real minutes (stepped in UTC, like the scraper)."""
+    records = []
+    ts = start.astimezone(timezone.utc)
+    while ts < end:
+        local = ts.astimezone(TZ)
+        records.append({"timestamp": local.isoformat(), "count": count(local), "status": "ok"})
+        ts += timedelta(minutes=10)
+    return records
+
+
+# 1. Test rollup of raw samples
+def test_rollup_raw_samples():
+    """Raw samples become min/mean/max/count per local hour."""
+    records = [
+        {"timestamp": "2025-10-13T10:00:00+02:00", "count": 10},
+        {"timestamp": "2025-10-13T10:10:00+02:00", "count": 20},
+        {"timestamp": "2025-10-13T10:50:00+02:00", "count": 30},
+        {"timestamp": "2025-10-13T11:00:00+02:00", "count": 5},
+    ]
+
+    hourly = rollup(records, "hour")
+
+    assert hourly["2025-10-13T10:00:00+02:00"] == {
+        "timestamp": "2025-10-13T10:00:00+02:00",
+        "min": 10,
+        "mean": 20.0,
+        "max": 30,
+        "count": 3,
+    }
+    assert hourly["2025-10-13T11:00:00+02:00"]["count"] == 1
+
+
+# 2. Test rollup of hourly summaries (weighted mean)
+def test_rollup_hourly_uses_weighted_mean():
+    """Daily means weight each hourly mean by its sample count."""
+    records = [
+        {"timestamp": "2025-10-13T10:00:00+02:00", "min": 0, "mean": 10.0, "max": 20, "count": 6},
+        {"timestamp": "2025-10-13T11:00:00+02:00", "min": 30, "mean": 40.0, "max": 50, "count": 2},
+    ]
+
+    daily = rollup(records, "day")
+
+    assert daily["2025-10-13T00:00:00+02:00"] == {
+        "timestamp": "2025-10-13T00:00:00+02:00",
+        "min": 0,
+        "mean": 17.5,  # (10 * 6 + 40 * 2) / 8, not (10 + 40) / 2
+        "max": 50,
+        "count": 8,
+    }
+
+
+# 3. Test records without a count
+def test_rollup_skips_records_without_count():
+    """Failed scrapes (count null or missing) do not affect the summaries."""
+    records = [
+        {"timestamp": "2025-10-13T10:00:00+02:00", "count": 10, "status": "ok"},
+        {"timestamp": "2025-10-13T10:10:00+02:00", "count": None, "status": "error"},
+        {"timestamp": "2025-10-13T10:20:00+02:00", "status": "error"},
+        {"timestamp": "2025-10-13T12:00:00+02:00", "count": None, "status": "error"},
+    ]
+
+    hourly = rollup(records, "hour")
+
+    assert list(hourly) == ["2025-10-13T10:00:00+02:00"]
+    assert hourly["2025-10-13T10:00:00+02:00"]["count"] == 1
+    assert hourly["2025-10-13T10:00:00+02:00"]["mean"] == 10.0
+
+
+# 4. Test DST-day buckets
+def test_rollup_dst_days():
+    """
+    On the autumn DST day the repeated 02:00 hour gets two hourly buckets,
+    and both fall-back and spring-forward days roll up into one local day.
+    """
+    autumn = raw_records(
+        datetime(2025, 10, 26, 0, 0, tzinfo=TZ),
+        datetime(2025, 10, 27, 0, 0, tzinfo=TZ),
+        count=lambda ts: 1,
+    )
+    spring = raw_records(
+        datetime(2025, 3, 30, 0, 0, tzinfo=TZ),
+        datetime(2025, 3, 31, 0, 0, tzinfo=TZ),
+        count=lambda ts: 1,
+    )
+
+    hourly = rollup(autumn, "hour")
+    assert hourly["2025-10-26T02:00:00+02:00"]["count"] == 6
+    assert hourly["2025-10-26T02:00:00+01:00"]["count"] == 6
+    assert len(hourly) == 25
+
+    daily = rollup(list(hourly.values()) + list(rollup(spring, "hour").values()), "day")
+    assert daily["2025-10-26T00:00:00+02:00"]["count"] == 25 * 6
+    assert daily["2025-03-30T00:00:00+01:00"]["count"] == 23 * 6
+    assert len(daily) == 2
+
+
+# 5. Test a full compaction pass and idempotency
+def test_compact_moves_data_into_tiers_and_is_idempotent(bucket, compactor):
+    """
+    Raw data older than the raw window becomes hourly rows, hourly rows
+    older than the hourly window become daily rows, and a second run
+    leaves every tier unchanged.
+    """
+    records = raw_records(NOW - timedelta(days=400), NOW)
+    bucket.put(RAW, records)
+
+    counts = compactor.compact(NOW)
+
+    raw = bucket.records(RAW)
+    hourly = bucket.records(HOURLY)
+    daily = bucket.records(DAILY)
+    raw_cutoff = datetime(2025, 10, 27, tzinfo=TZ)  # 35 days before today
+    hourly_cutoff = datetime(2024, 12, 1, tzinfo=TZ)  # 365 days before today
+
+    assert counts == {"raw": len(raw), "hourly": len(hourly), "daily": len(daily)}
+    assert min(datetime.fromisoformat(r["timestamp"]) for r in raw) == raw_cutoff
+    assert min(datetime.fromisoformat(r["timestamp"]) for r in hourly) == hourly_cutoff
+    assert max(datetime.fromisoformat(r["timestamp"]) for r in hourly) < raw_cutoff
+    assert max(datetime.fromisoformat(r["timestamp"]) for r in daily) < hourly_cutoff
+
+    # No sample is lost or double counted across the tiers
+    total = len(raw) + sum(r["count"] for r in hourly) + sum(r["count"] for r in daily)
+    assert total == len(records)
+
+    contents = {name: data for name, (data, _) in bucket.files.items()}
+    assert compactor.compact(NOW) == counts
+    assert {name: data for name, (data, _) in bucket.files.items()} == contents
+
+
+# 6. Test the PreconditionFailed path
+def test_compact_keeps_raw_log_when_scraper_appends(bucket, compactor):
+    """
+    If the raw log changes between read and rewrite, the rewrite is skipped,
+    the reported raw count reflects the untouched file, and the next run
+    produces the same rollups without double counting.
+    """
+    records = raw_records(NOW - timedelta(days=40), NOW)
+    bucket.put(RAW, records)
+    bucket.appended_during_upload.add(RAW)
+
+    counts = compactor.compact(NOW)
+
+    assert counts["raw"] == len(records)
+    assert len(bucket.records(RAW)) == len(records)
+    hourly = bucket.records(HOURLY)
+    assert hourly
+
+    bucket.appended_during_upload.clear()
+    counts = compactor.compact(NOW)
+
+    assert counts["raw"] == len(bucket.records(RAW)) < len(records)
+    assert bucket.records(HOURLY) == hourly
+
+
+def test_compactor_rejects_short_raw_retention(bucket):
+    """The dashboard's 4-week views need at least 28 days of raw samples."""
+    with patch("scraper.compaction.storage.Client"):
+        with pytest.raises(ValueError):
+            RollupCompactor("test-bucket", raw_retention_days=14)
@@ -1,17 +1,21 @@
 import io
 import json
 import logging
+import queue
+import threading
 from datetime import datetime, timedelta
-from time import time
+from time import sleep, time
 
 import numpy as np
 import pandas as pd
 import plotly
 import plotly.express as px
 import plotly.graph_objects as go
-from flask import Flask, abort, render_template, request
+from flask import Flask, Response, abort, render_template, request
 from google.cloud import storage
 
+from quantiles import SlotSketches
+
 app = Flask(__name__)
 
 logging.basicConfig(level=logging.INFO)
@@ -23,11 +27,29 @@ last_access = {}
 
 BUCKET_NAME = "fitnesspark-attendance-data"
 BLOB_PATH = "attendance/attendance_data.jsonl"
+# Rollup tiers written by the compaction job (see scraper/compaction.py)
+HOURLY_BLOB_PATH = "attendance/attendance_hourly.jsonl"
+DAILY_BLOB_PATH = "attendance/attendance_daily.jsonl"
+
+# Per-slot quantile sketches, fed incrementally across requests
+slot_sketches = SlotSketches()
+sketch_lock = threading.Lock()
+
+# Live updates: seconds between blob metadata polls and SSE keepalives
+WATCH_INTERVAL_SECONDS = 60
+HEARTBEAT_SECONDS = 25
+# Open /events connections allowed per IP (the stream bypasses the rate limiter)
+MAX_STREAMS_PER_IP = 5
+open_streams = {}
+stream_lock = threading.Lock()
 
 
 @app.before_request
 def limit_requests():
     """Simple IP-based rate limiter: allow 1 request every 2 seconds per IP."""
+    if request.path == "/events":
+        # EventSource gives up for good on a 429; streams are capped per IP instead
+        return
     ip = request.remote_addr
     now = time()
     if ip in last_access and now - last_access[ip] < 2:
@@ -42,18 +64,80 @@ def load_data_from_gcs():
     blob = bucket.blob(BLOB_PATH)
 
     data_bytes = blob.download_as_bytes()
+    return parse_attendance_jsonl(data_bytes)
+
+
+def parse_attendance_jsonl(data_bytes):
+    """Parse raw JSONL attendance records into a cleaned DataFrame."""
     df = pd.read_json(io.BytesIO(data_bytes), lines=True)
+    if df.empty:
+        return pd.DataFrame(columns=["timestamp", "sample_time", "attendance_count"])
     df.rename(columns={"count": "attendance_count"}, inplace=True)
     df["attendance_count"] = pd.to_numeric(df["attendance_count"], errors="coerce")
     df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True, errors="coerce")
     df.dropna(subset=["timestamp", "attendance_count"], inplace=True)
+    # Keep the unrounded time so each sample can be identified later
+    df["sample_time"] = df["timestamp"].dt.tz_convert("Europe/Zurich")
     df["timestamp"] = df["timestamp"].dt.floor("10min")
     df["timestamp"] = df["timestamp"].dt.tz_convert("Europe/Zurich")
     df.sort_values("timestamp", inplace=True)
     return df
 
 
-def compute_today_vs_typical(df):
+def load_tier_from_gcs(blob_path):
+    """Load one min/mean/max/count rollup tier; empty if not compacted yet."""
+    client = storage.Client()
+    blob = client.bucket(BUCKET_NAME).get_blob(blob_path)
+    columns = ["timestamp", "attendance_count", "min", "max", "samples"]
+    if blob is None:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.read_json(io.BytesIO(blob.download_as_bytes()), lines=True)
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    df.rename(columns={"mean": "attendance_count", "count": "samples"}, inplace=True)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True).dt.tz_convert(
+        "Europe/Zurich"
+    )
+    df.sort_values("timestamp", inplace=True)
+    return df[columns]
+
+
+def stitch_tiers(raw, hourly, daily):
+    """
+    Combine raw samples with older hourly and daily rollups into one
+    history frame. Each tier only covers the time before the next finer one;
+    `samples` is the number of raw samples behind each row.
+    """
+    tiers = []
+    start = None
+    for df, resolution, width in (
+        (raw, "10min", pd.Timedelta(minutes=10)),
+        (hourly, "hour", pd.Timedelta(hours=1)),
+        # A calendar day, so DST days end at the next local midnight (23/25 h)
+        (daily, "day", pd.DateOffset(days=1)),
+    ):
+        if df.empty:
+            continue
+        if start is not None:
+            # Only keep buckets that end before the finer tier begins
+            df = df[df["timestamp"] + width <= start]
+        samples = df["samples"] if "samples" in df.columns else 1
+        df = df[["timestamp", "attendance_count"]].assign(
+            samples=samples, resolution=resolution
+        )
+        if not df.empty:
+            tiers.append(df)
+            start = df["timestamp"].min()
+
+    if not tiers:
+        return raw[["timestamp", "attendance_count"]].assign(
+            samples=1, resolution="10min"
+        )
+    return pd.concat(tiers[::-1], ignore_index=True)
+
+
+def compute_today_vs_typical(df, sketches=None):
     now = pd.Timestamp.now("Europe/Zurich")
     df["time"] = df["timestamp"].dt.strftime("%H:%M")
     df["weekday"] = df["timestamp"].dt.strftime("%A")
@@ -77,6 +161,17 @@ def compute_today_vs_typical(df):
     )
     data_avg = df_avg[df_avg["weekday"] == today_weekday_name].sort_values("time")
 
+    # Percentile bands from the weekday x slot quantile sketches
+    if sketches is None:
+        sketches = SlotSketches()
+        sketches.ingest(df_recent)
+    bands = sketches.weekday_bands(today_weekday_name, four_weeks_ago)
+    data_avg = data_avg.copy()
+    for i, column in enumerate(["p10", "p50", "p90"]):
+        data_avg[column] = data_avg["time"].map(
+            lambda t: bands[t][i] if t in bands else np.nan
+        )
+
     return data_today, data_avg
 
 
@@ -157,11 +252,29 @@ def compute_weekly_summary(df):
 
 
 def compute_weekly_profiles(df):
+    """
+    Average attendance per weekday and 10-minute slot over the whole history.
+    Accepts stitched tiers: hourly rollups are spread over their six slots,
+    weighted by sample count; daily rollups carry no time of day and are skipped.
+    """
+    if "resolution" in df.columns:
+        hourly = df[df["resolution"] == "hour"]
+        spread = hourly.loc[hourly.index.repeat(6)].copy()
+        spread["timestamp"] += pd.to_timedelta(
+            np.tile(np.arange(0, 60, 10), len(hourly)), unit="min"
+        )
+        spread["samples"] = spread["samples"] / 6
+        df = pd.concat([df[df["resolution"] == "10min"], spread], ignore_index=True)
+    if "samples" not in df.columns:
+        df["samples"] = 1
+
     df["weekday"] = df["timestamp"].dt.day_name()
     df["time"] = df["timestamp"].dt.strftime("%H:%M")
+    df["weighted"] = df["attendance_count"] * df["samples"]
 
-    df_weekly = df.groupby(["weekday", "time"])["attendance_count"].mean().reset_index()
-    df_weekly.rename(columns={"attendance_count": "visitors"}, inplace=True)
+    df_weekly = df.groupby(["weekday", "time"])[["weighted", "samples"]].sum()
+    df_weekly["visitors"] = df_weekly["weighted"] / df_weekly["samples"]
+    df_weekly = df_weekly[["visitors"]].reset_index()
 
     # Filter for opening hours
     df_weekly = df_weekly[
@@ -239,6 +352,36 @@ def create_today_vs_typical_chart(today_data, avg_data):
             name="Typical",
         )
     )
+    fig.add_trace(
+        go.Scatter(
+            x=avg_data["time"],
+            y=avg_data["p90"],
+            mode="lines",
+            line=dict(width=0),
+            name="p90",
+            showlegend=False,
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=avg_data["time"],
+            y=avg_data["p10"],
+            mode="lines",
+            line=dict(width=0),
+            fill="tonexty",
+            fillcolor="rgba(99, 110, 250, 0.15)",
+            name="p10–p90",
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=avg_data["time"],
+            y=avg_data["p50"],
+            mode="lines",
+            line=dict(dash="dot"),
+            name="Median",
+        )
+    )
     fig.update_layout(
         title_text="Today vs. Typical Attendance",
         template="plotly_white",
@@ -331,24 +474,198 @@ def create_all_time_chart(df):
 
     return to_plain_json(fig)
 
+def update_sketches(df):
+    """
+    Feed `df` into the shared slot sketches and drop cells outside the
+    4-week window. Call with `sketch_lock` held; returns the accepted mask.
+    """
+    accepted = slot_sketches.ingest(df)
+    slot_sketches.prune(
+        (pd.Timestamp.now("Europe/Zurich") - timedelta(weeks=4)).date()
+    )
+    return accepted
+
+
+class ChangeWatcher:
+    """
+    Single background poller shared by all open dashboards.
+
+    Polls the blob's generation once per interval, downloads only the bytes
+    appended since the last poll, and pushes each new sample plus its updated
+    weekday x slot aggregate to every subscriber queue. Idle viewers never
+    trigger a download or a recomputation of the full dashboard, and the
+    thread stops polling as soon as the last subscriber leaves.
+    """
+
+    def __init__(self, interval=WATCH_INTERVAL_SECONDS):
+        self.interval = interval
+        self.generation = None
+        self.size = None
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=100)
+        with self.lock:
+            self.subscribers.append(q)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            if q in self.subscribers:
+                self.subscribers.remove(q)
+
+    def publish(self, event):
+        message = f"data: {json.dumps(event)}\n\n"
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # Slow client: drop the update rather than block everyone
+                pass
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    # Nobody listening: stop, and re-sync from scratch next time
+                    self.thread = None
+                    self.generation = self.size = None
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                self.logger.error(f"Change watcher poll failed: {e}", exc_info=True)
+            sleep(self.interval)
+
+    def poll(self):
+        """Check the blob once and publish any appended samples."""
+        client = storage.Client()
+        blob = client.bucket(BUCKET_NAME).get_blob(BLOB_PATH)
+        if blob is None or blob.generation == self.generation:
+            return 0
+
+        if self.size is None or blob.size < self.size:
+            # First poll or the file was rewritten: fill the sketches from the
+            # whole log so pushed aggregates never cover only the tail
+            data = blob.download_as_bytes(end=blob.size - 1) if blob.size else b""
+            df = parse_attendance_jsonl(data)
+            with sketch_lock:
+                update_sketches(df)
+            self.generation, self.size = blob.generation, blob.size
+            return 0
+
+        if blob.size == self.size:
+            self.generation = blob.generation
+            return 0
+
+        tail = blob.download_as_bytes(start=self.size, end=blob.size - 1)
+        df_new = parse_attendance_jsonl(tail)
+        # Advance the cursor only once the appended records were read
+        self.generation, self.size = blob.generation, blob.size
+        with sketch_lock:
+            # Rows seen before (e.g. resurrected by a racing rewrite) are not pushed again
+            accepted = update_sketches(df_new)
+            events = [self._make_event(row) for row in df_new[accepted].itertuples()]
+        for event in events:
+            self.publish(event)
+        return len(events)
+
+    def _make_event(self, row):
+        ts = row.timestamp
+        slot = ts.strftime("%H:%M")
+        event = {
+            "sample": {
+                "timestamp": ts.isoformat(),
+                "date": ts.strftime("%Y-%m-%d"),
+                "time": slot,
+                "attendance_count": float(row.attendance_count),
+            },
+            "slot": None,
+        }
+        if "06:30" <= slot <= "22:00":
+            # Same window as compute_today_vs_typical, so the cache is shared
+            now = pd.Timestamp.now("Europe/Zurich")
+            four_weeks_ago = (now - timedelta(weeks=4)).floor("10min")
+            summary = slot_sketches.slot_summary(
+                ts.strftime("%A"), slot, four_weeks_ago
+            )
+            if summary is not None:
+                event["slot"] = {"time": slot, **summary}
+        return event
+
+
+change_watcher = ChangeWatcher()
+
+
+@app.route("/events")
+def events():
+    """Server-Sent Events stream of new samples for open dashboards."""
+    ip = request.remote_addr
+    with stream_lock:
+        if open_streams.get(ip, 0) >= MAX_STREAMS_PER_IP:
+            abort(429)  # Too Many Requests
+        open_streams[ip] = open_streams.get(ip, 0) + 1
+    q = change_watcher.subscribe()
+
+    def close():
+        change_watcher.unsubscribe(q)
+        with stream_lock:
+            open_streams[ip] -= 1
+            if not open_streams[ip]:
+                del open_streams[ip]
+
+    def stream():
+        # Open the stream right away and ask clients to reconnect gently
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                yield q.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+
+    response = Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Runs on disconnect even if the stream was never iterated
+    response.call_on_close(close)
+    return response
+
+
 @app.route("/")
 def index():
     try:
         logger.info("Loading data from GCS.")
         df = load_data_from_gcs()
 
-        today_data, avg_data = compute_today_vs_typical(df.copy())
+        with sketch_lock:
+            update_sketches(df)
+            today_data, avg_data = compute_today_vs_typical(df.copy(), slot_sketches)
         summary, peaks = compute_weekly_summary(df.copy())
-        weekly_profiles = compute_weekly_profiles(df.copy())
+        history = stitch_tiers(
+            df,
+            load_tier_from_gcs(HOURLY_BLOB_PATH),
+            load_tier_from_gcs(DAILY_BLOB_PATH),
+        )
+        weekly_profiles = compute_weekly_profiles(history.copy())
 
         chart1_json = create_today_vs_typical_chart(today_data, avg_data)
         chart2_json = create_weekly_pattern_chart(weekly_profiles)
         table_json = create_summary_table(summary, peaks)
-        chart3_json = create_all_time_chart(df.copy())
+        chart3_json = create_all_time_chart(history)
 
+        now_date = pd.Timestamp.now("Europe/Zurich").strftime("%Y-%m-%d")
         warning_message = None
         if today_data.empty:
-            now_date = pd.Timestamp.now("Europe/Zurich").strftime("%Y-%m-%d")
             warning_message = f"No attendance data found for today ({now_date}). The data from the scraper might be stale or delayed."
 
         data = {
@@ -357,6 +674,7 @@ def index():
             "table_json": table_json,
             "chart3_json": chart3_json,
             "warning_message": warning_message,
+            "page_date": now_date,
         }
 
     except Exception as e:
@@ -0,0 +1,245 @@
+import math
+import random
+from datetime import date
+
+
+class KLLSketch:
+    """
+    Mergeable streaming quantile sketch (Karnin, Lang & Liberty, 2016).
+
+    Accuracy: with the default k=200 the rank error of any quantile query
+    is about 1.65% of n (99% confidence), independent of n.
+    Memory: at most ~k / (1 - c) = 3k retained values (~600 for k=200),
+    plus one extra level per doubling of n. Up to k values the sketch is
+    exact, which covers every single weekday x slot cell in this app.
+    """
+
+    def __init__(self, k: int = 200, c: float = 2 / 3, seed: int | None = None):
+        self.k = k
+        self.c = c
+        self.n = 0
+        self.total = 0.0
+        self.compactors = [[]]
+        self.max_size = self._capacity(0)
+        # Created on the first compaction; most cells never get that far
+        self._seed = seed
+        self._rng = None
+
+    def _capacity(self, height: int) -> int:
+        depth = len(self.compactors) - height - 1
+        return int(math.ceil(self.k * self.c**depth)) + 1
+
+    def _size(self) -> int:
+        return sum(len(c) for c in self.compactors)
+
+    def _grow(self) -> None:
+        self.compactors.append([])
+        self.max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def _compact(self, height: int) -> None:
+        """Halve one level, promoting every other item to the level above."""
+        items = sorted(self.compactors[height])
+        leftover = [items.pop()] if len(items) % 2 else []
+        if self._rng is None:
+            self._rng = random.Random(self._seed)
+        offset = self._rng.randint(0, 1)
+        if height + 1 >= len(self.compactors):
+            self._grow()
+        self.compactors[height + 1].extend(items[offset::2])
+        self.compactors[height] = leftover
+
+    def _compress(self) -> None:
+        while self._size() >= self.max_size:
+            for height in range(len(self.compactors)):
+                if len(self.compactors[height]) >= self._capacity(height):
+                    self._compact(height)
+                    break
+            else:
+                return
+
+    def update(self, value: float) -> None:
+        """Add a single observation."""
+        self.compactors[0].append(float(value))
+        self.n += 1
+        self.total += float(value)
+        if self._size() >= self.max_size:
+            self._compress()
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        """Fold another sketch into this one in place and return self."""
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for height, items in enumerate(other.compactors):
+            self.compactors[height].extend(items)
+        self.n += other.n
+        self.total += other.total
+        self._compress()
+        return self
+
+    def mean(self) -> float:
+        """Return the exact mean of all observations, NaN if empty."""
+        return self.total / self.n if self.n else math.nan
+
+    def quantile(self, q: float) -> float:
+        """Return the approximate q-quantile (0 <= q <= 1), NaN if empty."""
+        weighted = sorted(
+            (value, 2**height)
+            for height, items in enumerate(self.compactors)
+            for value in items
+        )
+        if not weighted:
+            return math.nan
+        total = sum(weight for _, weight in weighted)
+        target = q * total
+        cumulative = 0
+        for value, weight in weighted:
+            cumulative += weight
+            if cumulative >= target:
+                return value
+        return weighted[-1][0]
+
+
+class SlotSketches:
+    """
+    Quantile sketches of attendance keyed by (date, "HH:MM") slot.
+
+    Records are ingested incrementally: each sample is identified by its
+    unrounded `sample_time` (falling back to `timestamp`), so re-feeding a
+    growing log only adds unseen rows, including late or backfilled ones.
+    Rows dated before the last `prune()` boundary are ignored, so pruned
+    history is not ingested again on the next call.
+    Per-date cells are merged into one sketch per weekday x slot for the
+    requested window and cached; only slots touched by an ingest, or slots
+    leaving the window, are rebuilt. Whole instances can be merged across parks.
+    """
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.cells: dict[tuple[date, str], KLLSketch] = {}
+        self.seen = set()
+        self.horizon: date | None = None
+        self._windows: dict[str, dict] = {}
+        self._dirty: set[tuple[str, str]] = set()
+
+    def _add(self, key: tuple[date, str], sketch: KLLSketch) -> None:
+        if key not in self.cells:
+            self.cells[key] = KLLSketch(self.k)
+        self.cells[key].merge(sketch)
+        self._dirty.add((key[0].strftime("%A"), key[1]))
+
+    def ingest(self, df):
+        """
+        Add rows of `df` that have not been ingested before and return the
+        boolean mask of the rows that were accepted.
+        """
+        ids = df["sample_time"] if "sample_time" in df.columns else df["timestamp"]
+        mask = ~ids.isin(self.seen)
+        if self.horizon is not None and not df.empty:
+            mask &= df["timestamp"].dt.date >= self.horizon
+        if not mask.any():
+            return mask
+
+        df, ids = df[mask], ids[mask]
+        for ts, value in zip(df["timestamp"], df["attendance_count"]):
+            key = (ts.date(), ts.strftime("%H:%M"))
+            if key not in self.cells:
+                self.cells[key] = KLLSketch(self.k)
+            self.cells[key].update(value)
+            self._dirty.add((ts.strftime("%A"), key[1]))
+
+        self.seen.update(ids)
+        return mask
+
+    def merge(self, other: "SlotSketches") -> "SlotSketches":
+        """Fold another park's (or shard's) sketches into this one."""
+        for key, sketch in other.cells.items():
+            self._add(key, sketch)
+        self.seen.update(other.seen)
+        return self
+
+    def prune(self, before: date) -> None:
+        """Drop all cells and seen samples for dates before `before`."""
+        if self.horizon is None or before > self.horizon:
+            self.horizon = before
+        self.cells = {k: v for k, v in self.cells.items() if k[0] >= before}
+        self.seen = {ts for ts in self.seen if ts.date() >= before}
+        self._windows = {
+            weekday: window
+            for weekday, window in self._windows.items()
+            if window["since"].date() >= before
+        }
+
+    def _merged(self, weekday: str, since, slots=None):
+        """Merge the cells for `weekday` at or after `since`, keyed by slot."""
+        since_date = since.date()
+        since_time = since.strftime("%H:%M")
+
+        merged: dict[str, KLLSketch] = {}
+        for (day, cell_slot), sketch in self.cells.items():
+            if slots is not None and cell_slot not in slots:
+                continue
+            if day.strftime("%A") != weekday:
+                continue
+            if day < since_date or (day == since_date and cell_slot < since_time):
+                continue
+            if cell_slot not in merged:
+                merged[cell_slot] = KLLSketch(self.k)
+            merged[cell_slot].merge(sketch)
+        return merged
+
+    @staticmethod
+    def _summarize(sketch: KLLSketch) -> dict:
+        return {
+            "mean": sketch.mean(),
+            "p10": sketch.quantile(0.1),
+            "p50": sketch.quantile(0.5),
+            "p90": sketch.quantile(0.9),
+        }
+
+    def _window(self, weekday: str, since) -> dict[str, dict]:
+        """Return cached {slot: summary} for `weekday` since `since`."""
+        window = self._windows.get(weekday)
+        dirty = {slot for day, slot in self._dirty if day == weekday}
+
+        if (
+            window is None
+            or window["since"].date() != since.date()
+            or since < window["since"]
+        ):
+            stale = None
+        else:
+            # Same boundary day: only slots that just left the window change
+            old_time = window["since"].strftime("%H:%M")
+            new_time = since.strftime("%H:%M")
+            stale = dirty | {s for s in window["slots"] if old_time <= s < new_time}
+
+        if stale is None:
+            merged = self._merged(weekday, since)
+            window = {"since": since, "slots": {}}
+            self._windows[weekday] = window
+        elif stale:
+            merged = self._merged(weekday, since, stale)
+            for slot in stale:
+                window["slots"].pop(slot, None)
+        else:
+            merged = {}
+
+        for slot, sketch in merged.items():
+            window["slots"][slot] = self._summarize(sketch)
+        window["since"] = since
+        self._dirty -= {(weekday, slot) for slot in dirty}
+        return window["slots"]
+
+    def slot_summary(self, weekday: str, slot: str, since):
+        """Return mean and p10/p50/p90 for one weekday x slot, or None."""
+        return self._window(weekday, since).get(slot)
+
+    def weekday_bands(self, weekday: str, since):
+        """
+        Return {"HH:MM": [p10, p50, p90]} for `weekday` at or after `since`,
+        served from the per-slot cache.
+        """
+        return {
+            slot: [summary["p10"], summary["p50"], summary["p90"]]
+            for slot, summary in self._window(weekday, since).items()
+        }
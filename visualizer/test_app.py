@@ -1,5 +1,7 @@
 # test_app.py
 
+import queue
+
 import pytest
 from unittest.mock import patch, MagicMock
 import pandas as pd
@@ -7,7 +9,8 @@ from datetime import datetime
 import json
 
 # Assume app.py is in the same directory or accessible via PYTHONPATH
-from app import app as flask_app, load_data_from_gcs, compute_today_vs_typical, compute_weekly_summary, compute_weekly_profiles
+from app import app as flask_app, load_data_from_gcs, compute_today_vs_typical, compute_weekly_summary, compute_weekly_profiles, ChangeWatcher, MAX_STREAMS_PER_IP, stitch_tiers
+from quantiles import SlotSketches
 
 # Sample data for mocking GCS
 SAMPLE_JSONL = """
@@ -101,6 +104,11 @@ def test_compute_today_vs_typical(mock_pd_timestamp_now):
     assert avg_10_00['attendance_count'].iloc[0] == pytest.approx((10 + 8 + 6) / 3)
     assert avg_10_10['attendance_count'].iloc[0] == pytest.approx(20)
 
+    # Assert percentile bands come from the same 4-week window
+    assert avg_10_00['p10'].iloc[0] == 6
+    assert avg_10_00['p50'].iloc[0] == 8
+    assert avg_10_00['p90'].iloc[0] == 10
+
 
 # 3. Test compute_weekly_summary
 @patch('app.pd.Timestamp.now')
@@ -166,9 +174,10 @@ def test_compute_weekly_profiles():
     assert mon_profile.iloc[0]['visitors'] == 15  # (10+20)/2
 
 # 5. Test Flask route with Plotly charts
+@patch('app.load_tier_from_gcs', return_value=pd.DataFrame(columns=['timestamp', 'attendance_count']))
 @patch('app.pd.Timestamp.now')
 @patch('app.load_data_from_gcs')
-def test_index_route_with_plotly(mock_load_data, mock_pd_timestamp_now, client):
+def test_index_route_with_plotly(mock_load_data, mock_pd_timestamp_now, mock_load_tier, client):
     """
     Tests the main Flask route '/' with Plotly charts.
     Mocks the data loading function and checks for Plotly JSON in the response.
@@ -190,3 +199,254 @@ def test_index_route_with_plotly(mock_load_data, mock_pd_timestamp_now, client):
     assert b'Weekly Attendance Patterns' in response.data
     assert b'Weekly Summary and Peak Times' in response.data
     assert b'All-Time Attendance' in response.data
+    assert b'const PAGE_DATE = "2025-10-13"' in response.data
+
+
+# 6. Test stitching of retention tiers
+def test_stitch_tiers():
+    """
+    Tests the stitch_tiers function.
+    Verifies that each coarser tier only fills in history before the next
+    finer one and that the result is in chronological order.
+    """
+    def frame(timestamps, counts):
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(timestamps).tz_localize('Europe/Zurich'),
+            'attendance_count': counts,
+        })
+
+    raw = frame(['2025-10-13 10:00:00', '2025-10-13 10:10:00'], [10, 20])
+    hourly = frame(['2025-10-13 09:00:00', '2025-10-13 10:00:00'], [5, 15])  # 10:00 overlaps raw
+    daily = frame(['2025-10-12 00:00:00', '2025-10-13 00:00:00'], [30, 40])  # 13th overlaps hourly
+
+    history = stitch_tiers(raw, hourly, daily)
+
+    assert list(history['resolution']) == ['day', 'hour', '10min', '10min']
+    assert list(history['attendance_count']) == [30, 5, 10, 20]
+    assert history['timestamp'].is_monotonic_increasing
+
+
+def test_stitch_tiers_dst_days():
+    """
+    Tests that daily rollups of DST days end at the next local midnight:
+    the 23-hour spring day is kept when the finer tier starts the next
+    midnight, and the 25-hour autumn day is dropped when it overlaps.
+    """
+    def frame(timestamps, counts):
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(timestamps).tz_localize('Europe/Zurich'),
+            'attendance_count': counts,
+        })
+
+    empty = frame([], [])
+    spring_daily = frame(['2025-03-29 00:00:00', '2025-03-30 00:00:00'], [10, 20])
+    spring_raw = frame(['2025-03-31 00:00:00'], [30])
+    history = stitch_tiers(spring_raw, empty, spring_daily)
+    assert list(history['attendance_count']) == [10, 20, 30]
+
+    autumn_daily = frame(['2025-10-25 00:00:00', '2025-10-26 00:00:00'], [10, 20])
+    autumn_raw = frame(['2025-10-26 23:50:00'], [30])
+    history = stitch_tiers(autumn_raw, empty, autumn_daily)
+    assert list(history['attendance_count']) == [10, 30]
+
+
+def test_compute_weekly_profiles_uses_hourly_rollups():
+    """
+    Tests that weekly profiles keep covering history that was compacted:
+    hourly rollups are spread over their 10-minute slots and weighted by
+    their sample count, and daily rollups are ignored.
+    """
+    raw = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-10-13 10:00:00']).tz_localize('Europe/Zurich'),
+        'attendance_count': [40],
+    })
+    hourly = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-08-04 10:00:00']).tz_localize('Europe/Zurich'),  # a Monday
+        'attendance_count': [10.0],
+        'samples': [6],
+    })
+    daily = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-06-02 00:00:00']).tz_localize('Europe/Zurich'),
+        'attendance_count': [99.0],
+        'samples': [144],
+    })
+
+    profiles = compute_weekly_profiles(stitch_tiers(raw, hourly, daily))
+    monday = profiles[profiles['weekday'] == 'Monday'].set_index('time')['visitors']
+
+    assert list(monday.index) == ['10:00', '10:10', '10:20', '10:30', '10:40', '10:50']
+    assert monday['10:00'] == pytest.approx((40 + 10) / 2)
+    assert monday['10:50'] == pytest.approx(10)
+
+
+# 7. Test the change watcher behind the live updates
+def _mock_blob(mock_storage_client):
+    mock_blob = MagicMock()
+    mock_bucket = MagicMock()
+    mock_bucket.get_blob.return_value = mock_blob
+    mock_storage_client.return_value.bucket.return_value = mock_bucket
+    return mock_blob
+
+
+@patch('app.pd.Timestamp.now')
+@patch('app.slot_sketches', new_callable=SlotSketches)
+@patch('app.storage.Client')
+def test_change_watcher_pushes_only_new_samples(mock_storage_client, mock_sketches, mock_pd_timestamp_now):
+    """
+    Tests ChangeWatcher.poll.
+    The first poll fills the sketches from the whole log without publishing;
+    later polls download just the appended bytes and publish one event per
+    new sample, with an aggregate that covers the full history.
+    """
+    mock_pd_timestamp_now.return_value = pd.Timestamp('2025-10-13 12:00:00', tz='Europe/Zurich')
+    old = (
+        b'{"timestamp": "2025-08-04T10:00:00+02:00", "count": 1}\n'  # outside the window
+        b'{"timestamp": "2025-09-29T10:00:00+02:00", "count": 100}\n'
+        b'{"timestamp": "2025-10-06T10:00:00+02:00", "count": 100}\n'
+    )
+    new = b'{"timestamp": "2025-10-13T10:01:00+02:00", "count": 5}\n'
+    mock_blob = _mock_blob(mock_storage_client)
+
+    # Register a subscriber directly so no background thread is started
+    watcher = ChangeWatcher()
+    q = queue.Queue()
+    watcher.subscribers.append(q)
+
+    mock_blob.generation, mock_blob.size = 1, len(old)
+    mock_blob.download_as_bytes.return_value = old
+    assert watcher.poll() == 0
+    mock_blob.download_as_bytes.assert_called_once_with(end=len(old) - 1)
+    assert q.empty()
+    # The full ingest is pruned to the 4-week window like a page load
+    assert min(day for day, _ in mock_sketches.cells) == pd.Timestamp('2025-09-29').date()
+
+    # Unchanged generation: no download at all
+    mock_blob.download_as_bytes.reset_mock()
+    assert watcher.poll() == 0
+    mock_blob.download_as_bytes.assert_not_called()
+
+    mock_blob.generation, mock_blob.size = 2, len(old + new)
+    mock_blob.download_as_bytes.return_value = new
+    assert watcher.poll() == 1
+    mock_blob.download_as_bytes.assert_called_once_with(
+        start=len(old), end=len(old + new) - 1
+    )
+
+    event = json.loads(q.get_nowait()[len("data: "):])
+    assert event['sample']['date'] == '2025-10-13'
+    assert event['sample']['time'] == '10:00'
+    assert event['sample']['attendance_count'] == 5
+    assert event['slot']['time'] == '10:00'
+    assert event['slot']['mean'] == pytest.approx(205 / 3)
+    assert event['slot']['p90'] == 100
+
+    # A racing rewrite resurrects already-seen rows: they are not pushed again
+    resurrected = old[-len(b'{"timestamp": "2025-10-06T10:00:00+02:00", "count": 100}\n'):]
+    mock_blob.generation, mock_blob.size = 3, len(old + new + resurrected + new)
+    mock_blob.download_as_bytes.return_value = resurrected + new
+    assert watcher.poll() == 0
+    assert q.empty()
+
+
+@patch('app.pd.Timestamp.now')
+@patch('app.slot_sketches', new_callable=SlotSketches)
+@patch('app.storage.Client')
+def test_change_watcher_keeps_cursor_when_download_fails(mock_storage_client, mock_sketches, mock_pd_timestamp_now):
+    """
+    Tests that a failed tail download does not advance the cursor, so the
+    appended samples are still pushed on the next poll.
+    """
+    mock_pd_timestamp_now.return_value = pd.Timestamp('2025-10-13 12:00:00', tz='Europe/Zurich')
+    old = b'{"timestamp": "2025-10-06T10:00:00+02:00", "count": 8}\n'
+    new = b'{"timestamp": "2025-10-13T10:01:00+02:00", "count": 12}\n'
+    mock_blob = _mock_blob(mock_storage_client)
+
+    watcher = ChangeWatcher()
+    q = queue.Queue()
+    watcher.subscribers.append(q)
+
+    mock_blob.generation, mock_blob.size = 1, len(old)
+    mock_blob.download_as_bytes.return_value = old
+    watcher.poll()
+
+    mock_blob.generation, mock_blob.size = 2, len(old + new)
+    mock_blob.download_as_bytes.side_effect = ConnectionError("network down")
+    with pytest.raises(ConnectionError):
+        watcher.poll()
+    assert (watcher.generation, watcher.size) == (1, len(old))
+
+    mock_blob.download_as_bytes.side_effect = None
+    mock_blob.download_as_bytes.return_value = new
+    assert watcher.poll() == 1
+    assert not q.empty()
+
+
+@patch('app.sleep')
+def test_change_watcher_stops_without_subscribers(mock_sleep):
+    """
+    Tests that the polling thread exits once the last subscriber leaves and
+    resets its cursor, so zero viewers cost zero polls.
+    """
+    watcher = ChangeWatcher()
+    q = queue.Queue()
+    watcher.subscribers.append(q)
+    watcher.thread = MagicMock()
+    watcher.generation, watcher.size = 1, 10
+
+    def poll():
+        watcher.unsubscribe(q)
+        return 0
+
+    with patch.object(watcher, 'poll', side_effect=poll) as mock_poll:
+        watcher._run()
+
+    mock_poll.assert_called_once()
+    assert watcher.thread is None
+    assert (watcher.generation, watcher.size) == (None, None)
+
+
+# 8. Test the SSE route
+@patch('app.change_watcher.subscribe')
+def test_events_route_streams_pushed_samples(mock_subscribe, client):
+    """
+    Tests the '/events' route.
+    Verifies the event-stream content type and that queued messages are
+    forwarded to the client as-is.
+    """
+    q = queue.Queue()
+    q.put('data: {"sample": {}}\n\n')
+    mock_subscribe.return_value = q
+
+    response = client.get('/events')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert next(response.response) == b'retry: 5000\n\n'
+    assert next(response.response) == b'data: {"sample": {}}\n\n'
+    response.close()
+
+
+@patch('app.change_watcher.subscribe', side_effect=lambda: queue.Queue())
+@patch('app.load_tier_from_gcs', return_value=pd.DataFrame(columns=['timestamp', 'attendance_count']))
+@patch('app.load_data_from_gcs')
+def test_events_route_is_not_rate_limited_after_page_load(mock_load_data, mock_load_tier, mock_subscribe, client):
+    """
+    Tests that the EventSource request right after the page load is not
+    rejected by the per-IP rate limiter, while streams are capped per IP.
+    """
+    environ = {'REMOTE_ADDR': '10.0.0.27'}
+    mock_load_data.return_value = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-10-13 10:00:00']).tz_localize('Europe/Zurich'),
+        'attendance_count': [10],
+    })
+
+    assert client.get('/', environ_base=environ).status_code == 200
+    assert client.get('/favicon.ico', environ_base=environ).status_code == 429
+
+    streams = [client.get('/events', environ_base=environ) for _ in range(MAX_STREAMS_PER_IP)]
+    assert all(r.status_code == 200 for r in streams)
+    assert client.get('/events', environ_base=environ).status_code == 429
+
+    # Closing a stream frees its slot
+    streams[0].close()
+    assert client.get('/events', environ_base=environ).status_code == 200
@@ -0,0 +1,184 @@
+# test_quantiles.py
+
+import random
+
+import pandas as pd
+import pytest
+from unittest.mock import patch
+
+from quantiles import KLLSketch, SlotSketches
+
+
+def test_kll_sketch_is_exact_below_k():
+    """Small inputs are never compacted, so quantiles are exact."""
+    sketch = KLLSketch(k=200)
+    for value in range(1, 101):
+        sketch.update(value)
+
+    assert sketch.n == 100
+    assert sketch.quantile(0.1) == 10
+    assert sketch.quantile(0.5) == 50
+    assert sketch.quantile(0.9) == 90
+
+
+def test_kll_sketch_rank_error_and_memory_bound():
+    """Large inputs stay within the documented rank error and memory bound."""
+    rng = random.Random(42)
+    values = [rng.random() for _ in range(50_000)]
+    sketch = KLLSketch(k=200, seed=1)
+    for value in values:
+        sketch.update(value)
+
+    values.sort()
+    for q in (0.1, 0.5, 0.9):
+        estimate = sketch.quantile(q)
+        rank = sum(1 for v in values if v <= estimate) / len(values)
+        assert rank == pytest.approx(q, abs=0.0165)
+
+    retained = sum(len(c) for c in sketch.compactors)
+    assert retained <= 3 * 200 + len(sketch.compactors)
+
+
+def test_kll_sketch_merge():
+    """Merging two sketches matches a sketch over the combined stream."""
+    left, right = KLLSketch(seed=1), KLLSketch(seed=2)
+    for value in range(0, 5000):
+        left.update(value)
+    for value in range(5000, 10000):
+        right.update(value)
+
+    merged = left.merge(right)
+
+    assert merged.n == 10000
+    assert merged.quantile(0.5) == pytest.approx(5000, abs=165)
+
+
+def test_slot_sketches_ingest_is_incremental():
+    """Only samples that were not ingested before are added and reported."""
+    df = pd.DataFrame({
+        'timestamp': pd.to_datetime([
+            '2025-10-06 10:00:00',
+            '2025-10-13 10:00:00',
+        ]).tz_localize('Europe/Zurich'),
+        'attendance_count': [8, 10],
+    })
+    sketches = SlotSketches()
+
+    assert sketches.ingest(df).sum() == 2
+    assert sketches.ingest(df).sum() == 0
+
+    newer = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-10-13 10:10:00']).tz_localize('Europe/Zurich'),
+        'attendance_count': [20],
+    })
+    assert sketches.ingest(pd.concat([df, newer])).sum() == 1
+
+    # A backfilled row older than everything seen so far is still added
+    backfill = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-09-29 10:00:00']).tz_localize('Europe/Zurich'),
+        'attendance_count': [6],
+    })
+    assert sketches.ingest(backfill).sum() == 1
+
+
+def test_slot_sketches_keeps_late_samples_in_the_same_slot():
+    """Samples floored into the latest slot are identified by sample_time."""
+    def frame(sample_times, counts):
+        sample_time = pd.to_datetime(sample_times).tz_localize('Europe/Zurich')
+        return pd.DataFrame({
+            'timestamp': sample_time.floor('10min'),
+            'sample_time': sample_time,
+            'attendance_count': counts,
+        })
+
+    sketches = SlotSketches()
+    assert sketches.ingest(frame(['2025-10-13 10:01:00'], [10])).sum() == 1
+    assert sketches.ingest(frame(['2025-10-13 10:01:00', '2025-10-13 10:07:00'], [10, 20])).sum() == 1
+
+    assert sketches.cells[(pd.Timestamp('2025-10-13').date(), '10:00')].n == 2
+
+
+def test_slot_sketches_caches_bands_per_slot():
+    """Repeated queries are served from cache; ingests rebuild only their slot."""
+    since = pd.Timestamp('2025-09-15 12:00:00', tz='Europe/Zurich')
+    df = pd.DataFrame({
+        'timestamp': pd.to_datetime([
+            '2025-10-06 10:00:00',
+            '2025-10-06 11:00:00',
+        ]).tz_localize('Europe/Zurich'),
+        'attendance_count': [8, 30],
+    })
+    sketches = SlotSketches()
+    sketches.ingest(df)
+    assert sketches.weekday_bands('Monday', since)['10:00'] == [8, 8, 8]
+
+    with patch.object(sketches, '_merged', wraps=sketches._merged) as merged:
+        sketches.weekday_bands('Monday', since)
+        merged.assert_not_called()
+
+        sketches.ingest(pd.DataFrame({
+            'timestamp': pd.to_datetime(['2025-10-13 10:00:00']).tz_localize('Europe/Zurich'),
+            'attendance_count': [12],
+        }))
+        bands = sketches.weekday_bands('Monday', since)
+        merged.assert_called_once_with('Monday', since, {'10:00'})
+
+    assert bands['10:00'] == [8, 8, 12]
+    assert bands['11:00'] == [30, 30, 30]
+
+
+def test_slot_sketches_weekday_bands_and_merge():
+    """Bands merge per-date cells of one weekday and can combine parks."""
+    since = pd.Timestamp('2025-09-15 12:00:00', tz='Europe/Zurich')
+    park_a = pd.DataFrame({
+        'timestamp': pd.to_datetime([
+            '2025-09-15 10:00:00',  # Monday before the window start time
+            '2025-09-29 10:00:00',
+            '2025-10-06 10:00:00',
+            '2025-10-12 10:00:00',  # Sunday
+        ]).tz_localize('Europe/Zurich'),
+        'attendance_count': [100, 6, 8, 15],
+    })
+    park_b = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-10-13 10:00:00']).tz_localize('Europe/Zurich'),
+        'attendance_count': [10],
+    })
+
+    sketches = SlotSketches()
+    sketches.ingest(park_a)
+    other = SlotSketches()
+    other.ingest(park_b)
+    sketches.merge(other)
+
+    bands = sketches.weekday_bands('Monday', since)
+
+    assert list(bands) == ['10:00']
+    assert bands['10:00'] == [6, 8, 10]
+
+    sketches.prune(since.date())
+    assert all(day >= since.date() for day, _ in sketches.cells)
+
+
+def test_slot_sketches_prune_keeps_cache_warm_across_page_loads():
+    """Load + prune cycles with no new data never re-ingest pruned rows."""
+    now = pd.Timestamp('2025-10-13 12:00:00', tz='Europe/Zurich')
+    timestamps = pd.date_range(end=now, periods=120 * 144, freq='10min')
+    df = pd.DataFrame({
+        'timestamp': timestamps,
+        'attendance_count': [ts.hour for ts in timestamps],
+    })
+    since = (now - pd.Timedelta(weeks=4)).floor('10min')
+
+    def page_load():
+        added = sketches.ingest(df).sum()
+        sketches.prune(since.date())
+        sketches.weekday_bands('Monday', since)
+        return added
+
+    sketches = SlotSketches()
+    assert page_load() == len(df)
+
+    with patch.object(sketches, '_merged', wraps=sketches._merged) as merged:
+        assert page_load() == 0
+        assert page_load() == 0
+        merged.assert_not_called()